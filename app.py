@@ -1,34 +1,91 @@
 from os import path, mkdir
+import click
 from typing import BinaryIO
 from uuid import uuid4
 from marshmallow.exceptions import ValidationError
 from flask import Flask, jsonify, request, abort, send_from_directory, render_template
-from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required, JWTManager
+from flask_jwt_extended import create_access_token, create_refresh_token, decode_token, get_jwt, get_jwt_identity, jwt_required
 from flask_cors import CORS
-import imghdr
+from werkzeug.exceptions import TooManyRequests
+from sqlalchemy.orm import load_only, selectinload
+from sqlalchemy.orm.exc import StaleDataError
 from db import setup_db, db
-from db.models import Contact, Phone, Type, User
-from db.schemas import ContactSchema, PhoneSchema, user_schema, login_schema, contact_schema, phone_schema, type_schema
+from db.models import Contact, Export, Phone, Type, User
+from db.schemas import ContactSchema, PhoneSchema, user_schema, login_schema, contact_schema, phone_schema, type_schema, merge_schema
+from services.caller_id import CallerId
+from services import get_redis
+from services.dedup import find_duplicates
+from services.health import check_database, check_redis
+from services.jobs import JobQueue
+from services.phones import phone_key
+from services.rate_limit import RateLimiter
+from services.stats import RequestStats
+from services import tasks  # noqa: F401, registers background tasks
+from services.tokens import TokenManager
 from config import ProductionConfig
 
 
+# magic numbers of allowed image formats
+IMAGE_SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'png',
+    b'\xff\xd8\xff': 'jpg',
+}
+
+
 def validate_image(stream: BinaryIO):
     ''' Return correct image extension '''
     # check file format
-    header = stream.read(512)
+    header = stream.read(8)
     stream.seek(0)
-    format = imghdr.what(None, header)
-    # jpeg normally uses jpg file extension
-    return format if format != "jpeg" else "jpg"
+    for signature, format in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return format
+    return None
+
+
+def parse_fields(value: str, schema_cls):
+    '''
+    Parse a comma separated `fields` query parameter into a tuple of schema
+    fields, `id` is always included. Return None if value is empty.
+    '''
+    if not value:
+        return None
+    fields = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = fields - set(schema_cls._declared_fields)
+    if unknown:
+        abort(400, 'Unknown fields: %s' % ', '.join(sorted(unknown)))
+    return tuple(sorted(fields | {'id'}))
+
+
+def check_version(version: int):
+    ''' Abort with 412 if the If-Match header does not match the current version '''
+    if request.if_match and str(version) not in request.if_match:
+        abort(412, 'The resource was modified, fetch it and try again.')
+
+
+def job_public_data(job: dict):
+    ''' Return job data without task arguments '''
+    return {key: val for key, val in job.items() if key != 'kwargs'}
 
 
 def create_app(config=ProductionConfig):
     ''' create and configure the app '''
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_object(config)
-    jwt = JWTManager(app)
+    required = ['SECRET_KEY', 'SQLALCHEMY_DATABASE_URI']
+    if app.config['REDIS_REQUIRED']:
+        required.append('REDIS_URL')
+    for key in required:
+        if not app.config.get(key):
+            raise RuntimeError('%s is not configured' % key)
+    # registered first, so it measures time spent in the other hooks too
+    request_stats = RequestStats(app)
+    jwt = TokenManager(app)
     CORS(app)
+    RateLimiter(app)
     setup_db(app)
+    jobs = JobQueue(app)
+    caller_id = CallerId(app)
 
     ### ENDPOINTS ###
 
@@ -36,6 +93,32 @@ def create_app(config=ProductionConfig):
     def index():
         return render_template('index.html')
 
+    @app.get("/healthz")
+    def healthz():
+        return jsonify({
+            'status': 'ok'
+        })
+
+    @app.get("/readyz")
+    def readyz():
+        timeout = app.config['READINESS_TIMEOUT']
+        checks = {'database': check_database(db.get_engine(app), timeout)}
+        for shard in app.config['SHARDS']:
+            checks[shard] = check_database(db.get_engine(app, bind=shard), timeout, shard)
+        redis = get_redis(app)
+        if redis is not None:
+            checks['redis'] = check_redis(redis, timeout)
+
+        ready = all(check['ok'] for check in checks.values())
+        return jsonify({
+            'status': 'ok' if ready else 'unavailable',
+            **checks
+        }), 200 if ready else 503
+
+    @app.get("/stats")
+    def stats():
+        return jsonify(request_stats.snapshot())
+
     @app.post("/api/upload")
     @jwt_required()
     def upload():
@@ -78,7 +161,8 @@ def create_app(config=ProductionConfig):
             abort(422, 'Email or password is not correct.')
 
         return jsonify({
-            'token': create_access_token(user.id)
+            'token': create_access_token(user.id),
+            'refresh_token': create_refresh_token(user.id)
         })
 
     @app.post("/api/register")
@@ -89,14 +173,119 @@ def create_app(config=ProductionConfig):
 
         return jsonify({
             'token': create_access_token(identity=new_user.id),
+            'refresh_token': create_refresh_token(identity=new_user.id)
+        })
+
+    @app.post("/api/refresh")
+    @jwt_required(refresh=True)
+    def refresh():
+        return jsonify({
+            'token': create_access_token(identity=get_jwt_identity())
+        })
+
+    @app.post("/api/logout")
+    @jwt_required()
+    def logout():
+        jwt.revoke(get_jwt())
+        # revoke the refresh token too if it was sent
+        refresh_token = (request.get_json(silent=True) or {}).get('refresh_token')
+        if refresh_token:
+            try:
+                claims = decode_token(refresh_token)
+            except Exception:
+                abort(422, 'Invalid refresh token.')
+            if claims[app.config['JWT_IDENTITY_CLAIM']] != get_jwt_identity():
+                abort(403)
+            jwt.revoke(claims)
+
+        return jsonify({
+            'success': True
         })
 
     @app.get("/api/contacts")
     @jwt_required()
     def get_contacts():
-        contacts = Contact.query.filter_by(user_id=get_jwt_identity()).order_by(Contact.id.desc()).all()
+        fields = parse_fields(request.args.get('fields'), ContactSchema) \
+            or tuple(ContactSchema._declared_fields)
+        # only select the columns the response needs (notes and avatar can be large)
+        columns = [getattr(Contact, field) for field in fields if field != 'phones']
+        query = Contact.query.options(load_only(*columns)) \
+            .filter_by(user_id=get_jwt_identity()).order_by(Contact.id.desc())
+        if 'phones' in fields:
+            query = query.options(selectinload(Contact.phones))
+        contacts = query.all()
         return jsonify({
-            'data': contact_schema.dump(contacts, many=True)
+            'data': ContactSchema(only=fields).dump(contacts, many=True)
+        })
+
+    @app.get("/api/contacts/<int:id>")
+    @jwt_required()
+    def get_contact(id):
+        contact: Contact = Contact.query.options(
+            selectinload(Contact.phones)).get(id)
+        if not contact:
+            abort(404, 'Contact not found.')
+        if contact.user_id != get_jwt_identity():
+            abort(403)
+
+        return jsonify({
+            'data': contact_schema.dump(contact)
+        }), {'ETag': '"%i"' % contact.version}
+
+    @app.get("/api/contacts/duplicates")
+    @jwt_required()
+    def get_duplicates():
+        user_id = get_jwt_identity()
+        # plain rows, building orm objects for every contact is not needed here
+        contacts = db.session.query(Contact.id, Contact.name, Contact.email) \
+            .filter(Contact.user_id == user_id)
+        phones = db.session.query(Phone.contact_id, Phone.lookup_key) \
+            .join(Contact).filter(Contact.user_id == user_id)
+        return jsonify({
+            'data': find_duplicates(contacts, phones)
+        })
+
+    @app.post("/api/contacts/<int:id>/merge")
+    @jwt_required()
+    def merge_contacts(id):
+        ids = set(merge_schema.load(request.json)['ids']) - {id}
+        contact: Contact = Contact.query.options(
+            selectinload(Contact.phones)).get(id)
+        if not contact:
+            abort(404, 'Contact not found.')
+        duplicates = Contact.query.options(selectinload(Contact.phones)) \
+            .filter(Contact.id.in_(ids)).all()
+        if len(duplicates) != len(ids):
+            abort(404, 'Contact not found.')
+        if any(c.user_id != get_jwt_identity() for c in [contact, *duplicates]):
+            abort(403)
+        check_version(contact.version)
+
+        keys = {phone.lookup_key or phone.value for phone in contact.phones}
+        try:
+            for duplicate in duplicates:
+                # move phones which the contact does not have yet
+                for phone in list(duplicate.phones):
+                    key = phone.lookup_key or phone.value
+                    if key not in keys:
+                        keys.add(key)
+                        duplicate.phones.remove(phone)
+                        contact.phones.append(phone)
+                for key in ('email', 'avatar', 'notes'):
+                    if not getattr(contact, key):
+                        setattr(contact, key, getattr(duplicate, key))
+                db.session.delete(duplicate)
+            db.session.flush()
+            Contact.bump_version(contact.id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise e
+        caller_id.invalidate(contact.user_id)
+
+        return jsonify({
+            'data': contact_schema.dump(contact),
+            'deleted_ids': sorted(ids)
         })
 
     @app.post("/api/contacts")
@@ -112,6 +301,7 @@ def create_app(config=ProductionConfig):
             new_contact.phones.append(new_phone)
 
         new_contact.insert()
+        caller_id.invalidate(new_contact.user_id)
 
         return jsonify({
             'data': contact_schema.dump(new_contact)
@@ -125,6 +315,7 @@ def create_app(config=ProductionConfig):
             abort(404, 'Contact not found.')
         if contact.user_id != get_jwt_identity():
             abort(403)
+        check_version(contact.version)
 
         data = ContactSchema(exclude=['phones']).load(
             request.json, partial=True)
@@ -134,8 +325,8 @@ def create_app(config=ProductionConfig):
         contact.update()
 
         return jsonify({
-            'data': ContactSchema(only=('id', 'phones', *data)).dump(contact)
-        })
+            'data': ContactSchema(only=('id', 'version', 'phones', *data)).dump(contact)
+        }), {'ETag': '"%i"' % contact.version}
 
     @app.delete("/api/contacts/<int:id>")
     @jwt_required()
@@ -145,8 +336,10 @@ def create_app(config=ProductionConfig):
             abort(404, 'Contact not found.')
         if contact.user_id != get_jwt_identity():
             abort(403)
+        check_version(contact.version)
 
         contact.delete()
+        caller_id.invalidate(contact.user_id)
 
         return jsonify({
             'deleted_id': id
@@ -161,10 +354,13 @@ def create_app(config=ProductionConfig):
             abort(403)
 
         new_phone = Phone(**data)
+        Contact.bump_version(contact.id)
         new_phone.insert()
+        caller_id.invalidate(contact.user_id)
 
         return jsonify({
-            'data': phone_schema.dump(new_phone)
+            'data': phone_schema.dump(new_phone),
+            'contact_version': contact.version
         })
 
     @app.patch("/api/phones/<int:id>")
@@ -175,17 +371,21 @@ def create_app(config=ProductionConfig):
             abort(404, "Phone not found.")
         if phone.contact.user_id != get_jwt_identity():
             abort(403)
+        check_version(phone.version)
 
         data = PhoneSchema(exclude=['contact_id']).load(
             request.json, partial=True)
         for key, val in data.items():
             setattr(phone, key, val)
 
+        Contact.bump_version(phone.contact_id)
         phone.update()
+        caller_id.invalidate(phone.contact.user_id)
 
         return jsonify({
-            'data': PhoneSchema(only=('id', 'contact_id', *data)).dump(phone)
-        })
+            'data': PhoneSchema(only=('id', 'contact_id', 'version', *data)).dump(phone),
+            'contact_version': phone.contact.version
+        }), {'ETag': '"%i"' % phone.version}
 
     @app.delete("/api/phones/<int:id>")
     @jwt_required()
@@ -195,12 +395,87 @@ def create_app(config=ProductionConfig):
             abort(404, "Phone not found.")
         if phone.contact.user_id != get_jwt_identity():
             abort(403)
+        check_version(phone.version)
 
+        Contact.bump_version(phone.contact_id)
         phone.delete()
+        caller_id.invalidate(phone.contact.user_id)
 
         return jsonify({
             'deleted_id': id,
-            'contact_id': phone.contact_id
+            'contact_id': phone.contact_id,
+            'contact_version': phone.contact.version
+        })
+
+    @app.get("/api/lookup")
+    @jwt_required()
+    def lookup():
+        number = request.args.get('number', '')
+        key = phone_key(number)
+        if key is None:
+            abort(400, 'Invalid phone number.')
+
+        user_id = get_jwt_identity()
+        phones = db.session.query(Phone.contact_id, Phone.lookup_key) \
+            .join(Contact).filter(Contact.user_id == user_id)
+        index = caller_id.get_index(user_id, phones.all, phones.count)
+        if index is not None:
+            ids = index.find(key)
+        else:
+            ids = [id for id, in phones.with_entities(Phone.contact_id)
+                   .filter(Phone.lookup_key == key).distinct()]
+
+        contacts = Contact.query.options(load_only(Contact.id, Contact.name)) \
+            .filter(Contact.id.in_(ids)).all() if ids else []
+        return jsonify({
+            'data': ContactSchema(only=('id', 'name')).dump(contacts, many=True)
+        })
+
+    @app.post("/api/contacts/export")
+    @jwt_required()
+    def export_contacts():
+        job = jobs.enqueue('export_contacts', get_jwt_identity())
+        return jsonify({
+            'data': job_public_data(job)
+        }), 202
+
+    @app.delete("/api/user")
+    @jwt_required()
+    def delete_user():
+        job = jobs.enqueue('purge_account', get_jwt_identity())
+        # every access and refresh token of the user stops working
+        jwt.revoke_user(get_jwt_identity())
+        return jsonify({
+            'data': job_public_data(job)
+        }), 202
+
+    @app.get("/api/jobs/<job_id>")
+    @jwt_required()
+    def get_job(job_id):
+        job = jobs.get(job_id)
+        if not job:
+            abort(404, 'Job not found.')
+        if job['user_id'] != get_jwt_identity():
+            abort(403)
+
+        return jsonify({
+            'data': job_public_data(job)
+        })
+
+    @app.get("/api/jobs/<job_id>/download")
+    @jwt_required()
+    def download_job_result(job_id):
+        job = jobs.get(job_id)
+        if not job:
+            abort(404, 'Job not found.')
+        if job['user_id'] != get_jwt_identity():
+            abort(403)
+        export = Export.query.filter_by(job_id=job_id, user_id=get_jwt_identity()).scalar()
+        if not export:
+            abort(404, 'Job has no file to download.')
+
+        return app.response_class(export.content, mimetype='text/csv', headers={
+            'Content-Disposition': 'attachment; filename=contacts.csv'
         })
 
     @app.get("/api/types")
@@ -231,6 +506,19 @@ def create_app(config=ProductionConfig):
             'message': message,
         }), code
 
+    @app.errorhandler(StaleDataError)
+    def stale_data_error_handler(error):
+        # the row was changed by a concurrent request after we read it
+        return jsonify({
+            'message': 'The resource was modified, fetch it and try again.',
+        }), 412
+
+    @app.errorhandler(TooManyRequests)
+    def rate_limit_error_handler(error):
+        return jsonify({
+            'message': error.description,
+        }), 429, {'Retry-After': str(error.retry_after)}
+
     @app.errorhandler(ValidationError)
     def marshmallow_error_handler(error):
         return jsonify({
@@ -251,4 +539,15 @@ def create_app(config=ProductionConfig):
             db.session.rollback()
             raise e
 
+    @app.cli.command('reshard')
+    @click.argument('old_shards')
+    def reshard(old_shards):
+        '''
+        Move users whose shard changed from OLD_SHARDS (comma separated bind names) to SHARDS,
+        "main" moves them out of the main database
+        '''
+        from db.sharding import reshard
+        moved = reshard(app, db, old_shards.split(','))
+        click.echo('%i users moved' % moved)
+
     return app
@@ -0,0 +1,66 @@
+'''
+Measure the per request overhead of JWT authentication.
+
+Compares a protected no-op endpoint with the decoded claims cache disabled
+(every request verifies the token signature again) and enabled.
+
+usage: python benchmarks/auth_overhead.py [requests]
+'''
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from flask_jwt_extended import create_access_token, jwt_required  # noqa: E402
+from app import create_app  # noqa: E402
+from config import TestingConfig  # noqa: E402
+
+
+class BenchmarkConfig(TestingConfig):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+def run(claims_cache_size: int, requests: int):
+    config = type('Config', (BenchmarkConfig,), {
+        'TOKEN_CLAIMS_CACHE_SIZE': claims_cache_size})
+    app = create_app(config)
+
+    @app.get('/bench/protected')
+    @jwt_required()
+    def protected():
+        return ''
+
+    @app.get('/bench/public')
+    def public():
+        return ''
+
+    with app.app_context():
+        headers = {'Authorization': 'Bearer %s' % create_access_token(1)}
+    client = app.test_client()
+
+    def timeit(url, **kwargs):
+        client.get(url, **kwargs)  # warm up
+        start = perf_counter()
+        for _ in range(requests):
+            client.get(url, **kwargs)
+        return (perf_counter() - start) / requests * 1e6
+
+    public_us = timeit('/bench/public')
+    protected_us = timeit('/bench/protected', headers=headers)
+    return protected_us - public_us
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    before = run(0, requests)
+    after = run(1024, requests)
+    print('auth overhead per request (%i requests)' % requests)
+    print('  claims cache disabled: %8.1f us' % before)
+    print('  claims cache enabled:  %8.1f us' % after)
+
+
+if __name__ == '__main__':
+    main()
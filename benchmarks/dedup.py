@@ -0,0 +1,121 @@
+'''
+Measure duplicate detection on a synthetic account.
+
+Generates contacts where about 10% are re-imported copies of another contact,
+with a different phone format and a name variant: other casing, a typo,
+reordered tokens or a missing token. Times find_duplicates on rows in memory,
+then GET /api/contacts/duplicates against a seeded sqlite database, which
+includes its queries.
+
+usage: python benchmarks/dedup.py [contacts]
+'''
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from app import create_app  # noqa: E402
+from config import TestingConfig  # noqa: E402
+from db import db  # noqa: E402
+from db.models import Contact, Phone, Type, User  # noqa: E402
+from services.dedup import find_duplicates  # noqa: E402
+from services.phones import phone_key, to_e164  # noqa: E402
+
+FIRST_NAMES = ['Ahmed', 'Ali', 'Mona', 'Sara', 'Omar', 'Nour', 'Hassan', 'Laila', 'Youssef', 'Mariam']
+LAST_NAMES = ['Hamed', 'Mahmoud', 'Saleh', 'Farouk', 'Nabil', 'Adel', 'Kamal', 'Sami']
+MIDDLE_NAMES = ['Mohamed', 'Ibrahim', 'Mostafa', 'Khaled', 'Tarek', 'Samir']
+DUPLICATES_RATIO = 0.1
+
+
+def typo(name: str) -> str:
+    ''' Replace, drop or swap one letter '''
+    i = random.randrange(len(name) - 1)
+    kind = random.choice(('replace', 'drop', 'swap'))
+    if kind == 'replace':
+        return name[:i] + random.choice('abcdefghijklmnopqrstuvwxyz') + name[i + 1:]
+    if kind == 'drop':
+        return name[:i] + name[i + 1:]
+    return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+
+
+def variant(name: str) -> str:
+    tokens = name.split()
+    kind = random.choice(('case', 'typo', 'reorder', 'missing'))
+    if kind == 'case':
+        return name.upper()
+    if kind == 'typo':
+        return typo(name)
+    if kind == 'reorder':
+        return ' '.join([tokens[1], tokens[0], *tokens[2:]])
+    return ' '.join(tokens[:1] + tokens[2:])
+
+
+def generate(count: int):
+    random.seed(42)
+    contacts, phones = [], []
+    originals = int(count * (1 - DUPLICATES_RATIO))
+    for id in range(1, originals + 1):
+        name = '%s %s %s %i' % (random.choice(FIRST_NAMES), random.choice(MIDDLE_NAMES),
+                                random.choice(LAST_NAMES), id)
+        contacts.append((id, name, 'user%i@example.com' % id if id % 3 == 0 else None))
+        phones.append((id, '010%08i' % id))
+    for id in range(originals + 1, count + 1):
+        original = random.randint(1, originals)
+        _, name, email = contacts[original - 1]
+        contacts.append((id, variant(name), email))
+        phones.append((id, '+20 10 %08i' % original))
+    return contacts, phones
+
+
+def seed(database_uri: str, contacts, phones):
+    ''' Insert contacts and phones of a single user, return the app and its token '''
+    config = type('Config', (TestingConfig,), {'SQLALCHEMY_DATABASE_URI': database_uri})
+    app = create_app(config)
+    with app.app_context():
+        user = User('Benchmark', 'benchmark@test.com', 'secret')
+        mobile = Type('mobile')
+        db.session.add_all([user, mobile])
+        db.session.commit()
+        # plain inserts, building orm objects for every row would dominate the setup
+        db.session.execute(Contact.__table__.insert(), [
+            {'id': id, 'name': name, 'email': email, 'user_id': user.id, 'version': 1,
+             'created_at': datetime.utcnow()} for id, name, email in contacts])
+        db.session.execute(Phone.__table__.insert(), [
+            {'contact_id': contact_id, 'value': value, 'type_id': mobile.id, 'version': 1,
+             'e164': to_e164(value, app.config['PHONE_PATTERN'], app.config['PHONE_COUNTRY_CODE']),
+             'lookup_key': phone_key(value)} for contact_id, value in phones])
+        db.session.commit()
+        return app, create_access_token(user.id)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    contacts, phones = generate(count)
+    keys = [(contact_id, phone_key(value)) for contact_id, value in phones]
+    start = perf_counter()
+    groups = find_duplicates(contacts, keys)
+    elapsed = perf_counter() - start
+    print('find_duplicates, %i contacts: %i groups in %.2fs' % (count, len(groups), elapsed))
+    # copies are generated after every original
+    originals = int(count * (1 - DUPLICATES_RATIO))
+    found = sum(1 for group in groups for id in group['ids'] if id > originals)
+    print('  %i of %i copies found' % (found, count - originals))
+
+    with tempfile.TemporaryDirectory() as directory:
+        app, token = seed('sqlite:///' + os.path.join(directory, 'dedup.db'), contacts, phones)
+        client = app.test_client()
+        start = perf_counter()
+        res = client.get('/api/contacts/duplicates', headers={'Authorization': 'Bearer %s' % token})
+        elapsed = perf_counter() - start
+        assert res.status_code == 200, res.json
+        print('GET /api/contacts/duplicates, %i contacts: %i groups in %.2fs' % (
+            count, len(res.json['data']), elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+'''
+Compare gunicorn configurations under load.
+
+Seeds a sqlite database, then for each configuration starts gunicorn with
+gunicorn.conf.py (overridden through environment variables) and hammers
+GET /api/contacts from concurrent keep-alive clients.
+
+workers share rate limits and revoked tokens through redis, so REDIS_URL
+must point to a running server.
+
+usage: REDIS_URL=redis://localhost:6379/0 python benchmarks/loadtest.py [seconds] [clients]
+'''
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from time import perf_counter, sleep
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from app import create_app  # noqa: E402
+from config import TestingConfig  # noqa: E402
+from db.models import Contact, Phone, Type, User  # noqa: E402
+
+PORT = 8765
+SECRET_KEY = 'loadtest'
+CONFIGURATIONS = [
+    ('sync, 2 workers', {'GUNICORN_WORKER_CLASS': 'sync', 'WEB_CONCURRENCY': '2'}),
+    ('sync, 4 workers', {'GUNICORN_WORKER_CLASS': 'sync', 'WEB_CONCURRENCY': '4'}),
+    ('gthread, 2 workers x 4 threads', {'GUNICORN_WORKER_CLASS': 'gthread',
+                                        'WEB_CONCURRENCY': '2', 'GUNICORN_THREADS': '4'}),
+    ('gthread, 4 workers x 4 threads', {'GUNICORN_WORKER_CLASS': 'gthread',
+                                        'WEB_CONCURRENCY': '4', 'GUNICORN_THREADS': '4'}),
+    ('gthread, 4 workers, no preload', {'GUNICORN_WORKER_CLASS': 'gthread', 'WEB_CONCURRENCY': '4',
+                                        'GUNICORN_THREADS': '4', 'GUNICORN_PRELOAD': 'false'}),
+]
+
+
+def seed(database_uri: str, contacts: int = 200):
+    ''' Create tables and a user with contacts, return its token '''
+    config = type('Config', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': database_uri, 'SECRET_KEY': SECRET_KEY})
+    app = create_app(config)
+    with app.app_context():
+        user = User('Load Test', 'load@test.com', 'secret')
+        mobile = Type('mobile')
+        for i in range(contacts):
+            contact = Contact(None, 'Contact %i' % i)
+            phone = Phone('010%08i' % i, None, None)
+            phone.type = mobile
+            contact.phones.append(phone)
+            user.contacts.append(contact)
+        user.insert()
+        return create_access_token(user.id)
+
+
+def client(token: str, deadline: float, latencies: list, errors: list):
+    connection = http.client.HTTPConnection('127.0.0.1', PORT)
+    headers = {'Authorization': 'Bearer %s' % token}
+    while perf_counter() < deadline:
+        start = perf_counter()
+        try:
+            connection.request('GET', '/api/contacts?fields=name', headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(e)
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', PORT)
+            continue
+        latencies.append(perf_counter() - start)
+    connection.close()
+
+
+def wait_until_ready(timeout: float = 20):
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', PORT, timeout=1)
+            connection.request('GET', '/api/types')
+            connection.getresponse().read()
+            return
+        except OSError:
+            sleep(0.2)
+    raise RuntimeError('gunicorn did not start')
+
+
+def run(name: str, env: dict, token: str, seconds: float, clients: int):
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:create_app()'],
+        cwd=ROOT, env=dict(os.environ, PORT=str(PORT), **env),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready()
+        latencies, errors = [], []
+        deadline = perf_counter() + seconds
+        threads = [threading.Thread(target=client, args=(token, deadline, latencies, errors))
+                   for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    if not latencies:
+        print('%-34s no successful requests (%i errors)' % (name, len(errors)))
+        return
+    print('%-34s %8.0f req/s  p50 %6.1fms  p99 %6.1fms  errors %i' % (
+        name, len(latencies) / seconds,
+        latencies[len(latencies) // 2] * 1e3,
+        latencies[int(len(latencies) * 0.99)] * 1e3, len(errors)))
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    if not os.environ.get('REDIS_URL'):
+        sys.exit('REDIS_URL is not configured')
+    with tempfile.TemporaryDirectory() as directory:
+        database_uri = 'sqlite:///' + os.path.join(directory, 'loadtest.db')
+        token = seed(database_uri)
+        os.environ.update(DATABASE_URL=database_uri, SECRET_KEY=SECRET_KEY)
+        print('%i clients, %is per configuration' % (clients, seconds))
+        for name, env in CONFIGURATIONS:
+            run(name, env, token, seconds, clients)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+'''
+Measure cold start of a web worker.
+
+Runs `import app; app.create_app()` in fresh interpreters and reports the
+wall time, then lists the slowest imports reported by `python -X importtime`.
+
+usage: python benchmarks/startup.py [runs]
+'''
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+CODE = 'import app; app.create_app()'
+ENV = dict(os.environ, SECRET_KEY='benchmark', DATABASE_URL='sqlite://',
+           REDIS_URL=os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    timings = []
+    for _ in range(runs):
+        start = perf_counter()
+        subprocess.run([sys.executable, '-c', CODE], cwd=ROOT, env=ENV, check=True)
+        timings.append(perf_counter() - start)
+    timings.sort()
+    print('startup over %i runs: min %.0fms, median %.0fms' %
+          (runs, timings[0] * 1e3, timings[len(timings) // 2] * 1e3))
+
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', CODE], cwd=ROOT,
+                            env=ENV, capture_output=True, text=True, check=True).stderr
+    imports = []
+    for line in output.splitlines()[1:]:
+        _, cumulative, module = line.split('|')
+        depth = (len(module) - len(module.lstrip()) - 1) // 2
+        if depth == 1:  # modules imported by app itself
+            imports.append((int(cumulative), module.strip()))
+    print('slowest imports of app:')
+    for cumulative, module in sorted(imports, reverse=True)[:10]:
+        print('  %-30s %6.1fms' % (module, cumulative / 1e3))
+
+
+if __name__ == '__main__':
+    main()
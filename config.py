@@ -12,23 +12,83 @@ class Config(object):
 
     EMAIL_PATTERN = "^([\w\.\-]+)@([\w\-]+)((\.(\w){2,3})+)$"
     PHONE_PATTERN = "^\+(?:[0-9]){6,14}[0-9]$"
+    # country calling code used to normalize national phone numbers, e.g. 20
+    PHONE_COUNTRY_CODE = os.environ.get('PHONE_COUNTRY_CODE')
 
     UPLOAD_FOLDER = "uploads"
     ALLOWED_EXTENSIONS = {'png', 'jpg'}
     MAX_CONTENT_LENGTH = 5 * 1024 * 1024
 
     JWT_ERROR_MESSAGE_KEY = 'message'
-    JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=30)
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=15)
+    JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
+    # revoked tokens are looked up in a local cache first
+    # and "not revoked" answers are trusted for TOKEN_DENYLIST_CACHE_TTL seconds
+    TOKEN_DENYLIST_CACHE_SIZE = 4096
+    TOKEN_DENYLIST_CACHE_TTL = 5
+    TOKEN_CLAIMS_CACHE_SIZE = 1024
+
+    REDIS_URL = os.environ.get('REDIS_URL')
+    # token revocation, rate limits and jobs are shared by workers through redis,
+    # their in process fallbacks only fit a single process
+    REDIS_REQUIRED = False
+
+    # bind names of SQLALCHEMY_BINDS to shard contacts and phones across,
+    # users and types stay in the main database
+    SHARDS = []
+    # route contacts and phones to SHARDS, only enabled once existing data
+    # is moved out of the main database with "flask reshard main"
+    SHARDING_ENABLED = True
+    # seconds before /readyz reports a database or redis check as failed
+    READINESS_TIMEOUT = 1
+
+    # number of users whose phones are kept in memory for caller id lookups
+    CALLER_ID_CACHE_SIZE = 1000
+    # seconds an index is trusted when redis is not configured to invalidate it
+    CALLER_ID_CACHE_TTL = 5
+    # users with more phones are looked up in the database
+    CALLER_ID_MAX_PHONES = 100000
+
+    # seconds to keep finished jobs status in redis
+    JOB_RESULT_TTL = 24 * 60 * 60
+    # tasks enqueued periodically by workers, in seconds
+    JOB_SCHEDULE = {
+        'delete_expired_exports': 60 * 60,
+    }
+
+    # token bucket limits by endpoint name and identity kind ('ip', 'user' or 'email'),
+    # see services/rate_limit.py
+    RATE_LIMITS = {
+        'login': {'ip': '10/minute', 'email': '20/hour'},
+        'register': {'ip': '5/minute'},
+    }
+    # number of proxies in front of the app appending to X-Forwarded-For
+    PROXY_COUNT = int(os.environ.get('PROXY_COUNT', 0))
+
+
+def database_uri(url):
+    '''
+    replace url prefix "postgres" with "postgresql" as SQLALCHEMY has dropped support for "postgres" (for heroku)
+    see https://stackoverflow.com/a/64698899/10272966
+    see https://stackoverflow.com/a/66787229/10272966
+    '''
+    if url and url.startswith('postgres://'):
+        return url.replace('://', 'ql://', 1)
+    return url
 
 
 class ProductionConfig(Config):
     ''' Extend base config with production config '''
-    SECRET_KEY = os.environ['SECRET_KEY']
-    # replace url prefix "postgres" with "postgresql" as SQLALCHEMY has dropped support for "postgres" (for heroku)
-    # see https://stackoverflow.com/a/64698899/10272966
-    # see https://stackoverflow.com/a/66787229/10272966
-    SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URL'].replace(
-        '://', 'ql://', 1) if os.environ['DATABASE_URL'].startswith('postgres://') else os.environ['DATABASE_URL']
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    SQLALCHEMY_DATABASE_URI = database_uri(os.environ.get('DATABASE_URL'))
+    # comma separated databases, contacts and phones are sharded across them by user
+    SQLALCHEMY_BINDS = {'shard%i' % i: database_uri(url) for i, url in
+                        enumerate(filter(None, os.environ.get('SHARD_DATABASE_URLS', '').split(',')))}
+    SHARDS = list(SQLALCHEMY_BINDS)
+    SHARDING_ENABLED = os.environ.get('SHARDING_ENABLED', '').lower() == 'true'
+    REDIS_REQUIRED = True
+    # behind the heroku router remote_addr is the router, set 0 when serving directly
+    PROXY_COUNT = int(os.environ.get('PROXY_COUNT', 1))
 
 
 class TestingConfig(Config):
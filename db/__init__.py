@@ -1,7 +1,17 @@
+import click
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from sqlalchemy import orm
+from db.sharding import RoutingSession, create_shards, setup_sharding
 
-db = SQLAlchemy()
+
+class ShardedSQLAlchemy(SQLAlchemy):
+    ''' SQLAlchemy routing contacts and phones to the shard of their user, see db/sharding.py '''
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = ShardedSQLAlchemy()
 
 
 def setup_db(app):
@@ -13,9 +23,27 @@ def setup_db(app):
 
     db.app = app
     db.init_app(app)
+    setup_sharding(app, db)
 
     # do not use migrations in test environment
     if app.config['TESTING'] is True:
         db.create_all()
-    else:
+        if app.config['SHARDS']:
+            create_shards(app, db)
+    elif click.get_current_context(silent=True) is not None:
+        # migrations are only needed by "flask db" commands,
+        # so web and job workers do not import alembic
+        from flask_migrate import Migrate
         Migrate(app, db)
+
+
+def dispose_engines(app):
+    '''
+    dispose_engines(app)
+
+    drop pooled connections of every engine of the app.
+    called in forked workers, so connections are never shared across processes
+    '''
+    with app.app_context():
+        for bind in list(app.extensions['sqlalchemy'].connectors):
+            db.get_engine(app, bind).dispose()
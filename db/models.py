@@ -1,8 +1,9 @@
-import bcrypt
 from datetime import datetime
 from sqlalchemy import exc, Column, Integer, VARCHAR, Text, DateTime, LargeBinary
+from sqlalchemy.orm import validates
 from sqlalchemy.sql.schema import ForeignKey
 from db import db
+from services.phones import phone_key, to_e164
 
 
 class BaseModel:
@@ -48,6 +49,8 @@ class User(db.Model, BaseModel):
     contacts = db.relationship('Contact', lazy=True, cascade='all')
 
     def __init__(self, name, email, password):
+        # bcrypt is only needed by a few endpoints, import it on first use
+        import bcrypt
         self.name = name
         self.email = email
         self.password = bcrypt.hashpw(
@@ -55,6 +58,7 @@ class User(db.Model, BaseModel):
 
     def checkpw(self, password: str):
         ''' Check if the provided password is equal to user password '''
+        import bcrypt
         return bcrypt.checkpw(bytes(password, 'utf-8'), self.password)
 
     def set_pw(self, password: str):
@@ -62,6 +66,7 @@ class User(db.Model, BaseModel):
         Set current user passowed.
         password is hashed first before getting assigned to user
         '''
+        import bcrypt
         self.password = bcrypt.hashpw(
             bytes(password, 'utf-8'), bcrypt.gensalt(12))
 
@@ -77,6 +82,9 @@ class Contact(db.Model, BaseModel):
         'Phone', backref="contact", order_by='asc(Phone.id)', lazy=True, cascade='all')
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    # incremented on every update, concurrent updates of the same version fail
+    version = Column(Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, user_id: int, name: str, email: str = None, avatar: str = None):
         self.user_id = user_id
@@ -84,6 +92,15 @@ class Contact(db.Model, BaseModel):
         self.email = email
         self.avatar = avatar
 
+    @staticmethod
+    def bump_version(id: int):
+        '''
+        Increment version of contact when its phones change, as they are part of it.
+        done in sql, so concurrent phone changes do not conflict with each other
+        '''
+        Contact.query.filter_by(id=id).update(
+            {Contact.version: Contact.version + 1}, synchronize_session=False)
+
 class Type(db.Model, BaseModel):
     __tablename__ = "types"
     id = Column(Integer, primary_key=True)
@@ -97,11 +114,40 @@ class Phone(db.Model, BaseModel):
     __tablename__ = "phones"
     id = Column(Integer, primary_key=True)
     value = Column(VARCHAR, nullable=False)
+    # canonical E.164 form of value, None if value cannot be normalized
+    e164 = Column(VARCHAR, nullable=True)
+    # last digits of value used to find callers and duplicates, see services/phones.py
+    lookup_key = Column(VARCHAR, nullable=True, index=True)
     type_id = Column(Integer, ForeignKey('types.id'), nullable=False)
     type = db.relationship('Type')
     contact_id = Column(Integer, ForeignKey('contacts.id'), nullable=False)
+    version = Column(Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, value: str, type_id: int, contact_id: int):
         self.value = value
         self.type_id = type_id
         self.contact_id = contact_id
+
+    @validates('value')
+    def normalize_value(self, key, value):
+        ''' Keep e164 and lookup_key columns in sync with phone value '''
+        config = db.get_app().config
+        self.e164 = to_e164(value, config['PHONE_PATTERN'], config['PHONE_COUNTRY_CODE'])
+        self.lookup_key = phone_key(value)
+        return value
+
+
+class Export(db.Model, BaseModel):
+    __tablename__ = "exports"
+    # csv file of an export job, kept in the database so any process can serve it
+    id = Column(Integer, primary_key=True)
+    job_id = Column(VARCHAR, nullable=False, unique=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    content = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __init__(self, job_id: str, user_id: int, content: bytes):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.content = content
@@ -1,5 +1,4 @@
 from marshmallow import Schema, fields, validate, validates, ValidationError, post_load
-from sqlalchemy.sql.expression import true
 from db.models import Contact, Type, User
 
 
@@ -41,8 +40,10 @@ type_schema = TypeSchema()
 class PhoneSchema(Schema):
     id = fields.Int(dump_only=True)
     value = fields.Str(required=True)
+    e164 = fields.Str(dump_only=True)
     type_id = fields.Int(required=True)
     contact_id = fields.Int(required=True)
+    version = fields.Int(dump_only=True)
 
     @validates('type_id')
     def validate_type(self, value):
@@ -63,8 +64,17 @@ class ContactSchema(Schema):
     name = fields.Str(required=True)
     email = fields.Email(required=False)
     notes = fields.Str(required=False)
+    version = fields.Int(dump_only=True)
     phones = fields.List(fields.Nested(
         PhoneSchema(exclude=['contact_id'])), required=True)
 
 
 contact_schema = ContactSchema()
+
+
+class MergeSchema(Schema):
+    ids = fields.List(fields.Int(), required=True,
+                      validate=validate.Length(min=1))
+
+
+merge_schema = MergeSchema()
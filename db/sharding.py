@@ -0,0 +1,220 @@
+from bisect import bisect
+from contextlib import contextmanager
+from contextvars import ContextVar
+from hashlib import md5
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import Column, ForeignKey, MetaData, Table, select
+
+# tables partitioned by user, every other table (users, types) stays global
+SHARDED_TABLES = ('contacts', 'phones')
+# pseudo bind name of the main database, where contacts and phones live before sharding
+MAIN = 'main'
+
+_shard_user_id = ContextVar('shard_user_id', default=None)
+
+
+def _hash(value: str) -> int:
+    return int(md5(value.encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    '''
+    Consistent hash ring of shard names.
+    adding a shard only moves about 1/N of the users
+    '''
+
+    def __init__(self, shards, replicas: int = 100):
+        self.shards = list(shards)
+        points = sorted((_hash('%s:%i' % (shard, i)), shard)
+                        for shard in self.shards for i in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def get(self, user_id: int) -> str:
+        ''' Return shard of user '''
+        i = bisect(self._hashes, _hash(str(user_id))) % len(self._hashes)
+        return self._shards[i]
+
+
+@contextmanager
+def shard_scope(user_id: int):
+    '''
+    Route contacts and phones queries of the block to the shard of user_id.
+    requests are scoped automatically by the JWT subject
+    '''
+    token = _shard_user_id.set(user_id)
+    try:
+        yield
+    finally:
+        _shard_user_id.reset(token)
+
+
+def get_ring(app):
+    ''' Return hash ring of the app or None if sharding is disabled '''
+    return app.extensions.get('shards')
+
+
+class RoutingSession(SignallingSession):
+    ''' Session routing sharded tables to the bind of the current shard scope '''
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        ring = get_ring(self.app)
+        if ring is not None and mapper is not None \
+                and mapper.persist_selectable.name in SHARDED_TABLES:
+            user_id = _shard_user_id.get()
+            if user_id is None:
+                raise RuntimeError('%s is sharded, query it inside shard_scope(user_id)'
+                                   % mapper.persist_selectable.name)
+            return self.db.get_engine(self.app, bind=ring.get(user_id))
+        return super().get_bind(mapper, clause)
+
+
+def setup_sharding(app, db):
+    '''
+    setup_sharding(app, db)
+
+    enable sharding if SHARDS lists bind names of SQLALCHEMY_BINDS
+    and SHARDING_ENABLED is set
+    '''
+    shards = app.config.get('SHARDS')
+    if not shards or not app.config.get('SHARDING_ENABLED'):
+        return
+    app.extensions['shards'] = HashRing(shards)
+
+    @app.before_request
+    def enter_shard_scope():
+        from flask import g
+        from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+        try:
+            verify_jwt_in_request(optional=True)
+        except Exception:
+            # invalid tokens are rejected by the view itself
+            return
+        user_id = get_jwt_identity()
+        if user_id is not None:
+            g.shard_scope_token = _shard_user_id.set(user_id)
+
+    @app.teardown_request
+    def exit_shard_scope(error=None):
+        from flask import g
+        token = g.pop('shard_scope_token', None)
+        if token is not None:
+            _shard_user_id.reset(token)
+
+
+def shard_metadata(metadata):
+    '''
+    Return copy of the sharded tables without foreign keys to global tables,
+    which live in another database
+    '''
+    shard_metadata = MetaData()
+    for name in SHARDED_TABLES:
+        table = metadata.tables[name]
+        columns = []
+        for column in table.columns:
+            foreign_keys = [ForeignKey(fk.target_fullname) for fk in column.foreign_keys
+                            if fk.column.table.name in SHARDED_TABLES]
+            columns.append(Column(column.name, column.type, *foreign_keys,
+                                  primary_key=column.primary_key, nullable=column.nullable,
+                                  index=column.index))
+        Table(name, shard_metadata, *columns)
+    return shard_metadata
+
+
+def migrating_shard():
+    '''
+    Return bind name of the shard being migrated or None for the main database.
+    used by revisions to skip tables which are not sharded
+    '''
+    from alembic import context
+    return context.config.attributes.get('shard')
+
+
+def create_shards(app, db):
+    '''
+    Create sharded tables on every shard, used by tests.
+    "flask db upgrade" creates and migrates the shards otherwise
+    '''
+    metadata = shard_metadata(db.metadata)
+    for shard in app.config['SHARDS']:
+        metadata.create_all(db.get_engine(app, bind=shard))
+
+
+def get_engine(app, db, bind: str):
+    ''' Return engine of a shard bind name, MAIN is the main database '''
+    return db.get_engine(app, bind=None if bind == MAIN else bind)
+
+
+def move_user(app, db, user_id: int, source: str, target: str):
+    '''
+    Copy contacts and phones of user from source shard to target, then delete them from source.
+    either may be MAIN, contacts and phones get new ids on the target
+    '''
+    metadata = shard_metadata(db.metadata)
+    contacts, phones = metadata.tables['contacts'], metadata.tables['phones']
+    source_engine = get_engine(app, db, source)
+    target_engine = get_engine(app, db, target)
+
+    with source_engine.connect() as connection:
+        contact_rows = connection.execute(
+            select(contacts).where(contacts.c.user_id == user_id)).mappings().all()
+        contact_ids = [row['id'] for row in contact_rows]
+        phone_rows = connection.execute(
+            select(phones).where(phones.c.contact_id.in_(contact_ids))).mappings().all()
+    if not contact_rows:
+        # nothing to move, or already moved by an earlier run
+        return 0
+
+    with target_engine.begin() as connection:
+        # leftovers of an interrupted move
+        stale_ids = select(contacts.c.id).where(contacts.c.user_id == user_id)
+        connection.execute(phones.delete().where(phones.c.contact_id.in_(stale_ids)))
+        connection.execute(contacts.delete().where(contacts.c.user_id == user_id))
+
+        new_ids = {}
+        for row in contact_rows:
+            values = {key: val for key, val in row.items() if key != 'id'}
+            new_ids[row['id']] = connection.execute(
+                contacts.insert().values(**values)).inserted_primary_key[0]
+        if phone_rows:
+            connection.execute(phones.insert(), [
+                {**{key: val for key, val in row.items() if key != 'id'},
+                 'contact_id': new_ids[row['contact_id']]} for row in phone_rows])
+
+    with source_engine.begin() as connection:
+        connection.execute(phones.delete().where(phones.c.contact_id.in_(contact_ids)))
+        connection.execute(contacts.delete().where(contacts.c.user_id == user_id))
+
+    return len(contact_rows)
+
+
+def reshard(app, db, old_shards, batch_size: int = 500):
+    '''
+    Move users whose shard changed from the old shards list to SHARDS.
+    users are read in batches, each user is moved on its own,
+    so an interrupted resharding can simply be run again.
+    writes of a user made while it is being moved can be lost,
+    run it while the app is in maintenance.
+
+    old_shards ['main'] moves every user out of the main database, to shard
+    existing data: set SHARD_DATABASE_URLS, run "flask db upgrade" to create
+    the shards, "flask reshard main", then set SHARDING_ENABLED to route to them
+    '''
+    from db.models import User
+    old_ring, ring = HashRing(old_shards), HashRing(app.config['SHARDS'])
+    moved, last_id = 0, 0
+    while True:
+        ids = [id for id, in db.session.query(User.id).filter(User.id > last_id)
+               .order_by(User.id).limit(batch_size)]
+        if not ids:
+            return moved
+        for user_id in ids:
+            source, target = old_ring.get(user_id), ring.get(user_id)
+            if source != target and move_user(app, db, user_id, source, target):
+                app.extensions['caller_id'].invalidate(user_id)
+                moved += 1
+        last_id = ids[-1]
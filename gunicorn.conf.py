@@ -0,0 +1,46 @@
+'''
+Gunicorn production configuration, loaded by the Procfile.
+settings can be overridden with the environment variables below
+'''
+import gc
+import multiprocessing
+import os
+
+bind = '0.0.0.0:%s' % os.environ.get('PORT', '8000')
+
+# gthread (default), sync or gevent (needs the gevent package)
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# WEB_CONCURRENCY is set by heroku according to the dyno size
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# requests mostly wait on the database, threads overlap those waits
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+
+# load the app once in the master and share its memory with forked workers
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true') == 'true'
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# recycle workers to bound memory growth, jitter avoids restarting all at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# request counts, latencies and worker events are sent to statsd when configured
+statsd_host = os.environ.get('STATSD_HOST')
+statsd_prefix = os.environ.get('STATSD_PREFIX', 'phonebook')
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG')
+
+
+def pre_fork(server, worker):
+    # move objects loaded by the master out of the gc generations,
+    # so collections in workers do not write to (and copy) shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # pooled database connections must not be shared with the master
+    from db import dispose_engines
+    dispose_engines(server.app.wsgi())
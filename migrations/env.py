@@ -4,8 +4,12 @@ import logging
 from logging.config import fileConfig
 
 from flask import current_app
+from sqlalchemy import inspect
 
 from alembic import context
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from db.sharding import shard_metadata
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -53,6 +57,19 @@ def run_migrations_offline():
         context.run_migrations()
 
 
+def prepare_shard(connection):
+    '''
+    Create tables of a new shard and stamp it at head,
+    so the revisions made before the shard existed never run on it
+    '''
+    if 'alembic_version' in inspect(connection).get_table_names():
+        return
+    script = ScriptDirectory.from_config(config)
+    with connection.begin():
+        shard_metadata(target_metadata).create_all(connection)
+        MigrationContext.configure(connection).stamp(script, script.get_current_head())
+
+
 def run_migrations_online():
     """Run migrations in 'online' mode.
 
@@ -71,7 +88,8 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
-    connectable = current_app.extensions['migrate'].db.get_engine()
+    db = current_app.extensions['migrate'].db
+    connectable = db.get_engine()
 
     with connectable.connect() as connection:
         context.configure(
@@ -84,6 +102,26 @@ def run_migrations_online():
         with context.begin_transaction():
             context.run_migrations()
 
+    # sharded tables are migrated on every shard, which has its own alembic_version.
+    # revisions skip tables which are not sharded, see db.sharding.migrating_shard.
+    # autogenerate compares the main database only, it has every table
+    if getattr(config.cmd_opts, 'autogenerate', False):
+        return
+    for shard in current_app.config['SHARDS']:
+        with db.get_engine(bind=shard).connect() as connection:
+            prepare_shard(connection)
+            config.attributes['shard'] = shard
+            try:
+                context.configure(
+                    connection=connection,
+                    target_metadata=shard_metadata(target_metadata),
+                    **current_app.extensions['migrate'].configure_args
+                )
+                with context.begin_transaction():
+                    context.run_migrations()
+            finally:
+                del config.attributes['shard']
+
 
 if context.is_offline_mode():
     run_migrations_offline()
@@ -0,0 +1,67 @@
+"""Add e164 column to Phone
+
+Revision ID: 3f9c2b7d41e6
+Revises: a6d1f22ef4c8
+Create Date: 2026-10-19 10:12:40.518236
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+from services.phones import to_e164
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2b7d41e6'
+down_revision = 'a6d1f22ef4c8'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def backfill_e164():
+    '''
+    Normalize existing phones in batches.
+    every batch is committed on its own, so an interrupted backfill
+    resumes from the rows which are still not normalized
+    '''
+    pattern = current_app.config['PHONE_PATTERN']
+    country_code = current_app.config['PHONE_COUNTRY_CODE']
+    phones = sa.table('phones', sa.column('id', sa.Integer),
+                      sa.column('value', sa.VARCHAR), sa.column('e164', sa.VARCHAR))
+    select = sa.select(phones.c.id, phones.c.value) \
+        .where(phones.c.e164.is_(None), phones.c.id > sa.bindparam('last_id')) \
+        .order_by(phones.c.id).limit(BATCH_SIZE)
+    update = phones.update().where(phones.c.id == sa.bindparam('phone_id')) \
+        .values(e164=sa.bindparam('e164'))
+
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        last_id = 0
+        while True:
+            rows = connection.execute(select, {'last_id': last_id}).fetchall()
+            if not rows:
+                break
+            values = [{'phone_id': id, 'e164': to_e164(value, pattern, country_code)}
+                      for id, value in rows]
+            values = [value for value in values if value['e164'] is not None]
+            if values:
+                connection.execute(update, values)
+            last_id = rows[-1][0]
+
+
+def upgrade():
+    # the backfill commits the column and index before the revision is stamped,
+    # so after an interruption they already exist when the upgrade is run again
+    inspector = sa.inspect(op.get_bind())
+    if 'e164' not in [column['name'] for column in inspector.get_columns('phones')]:
+        op.add_column('phones', sa.Column('e164', sa.VARCHAR(), nullable=True))
+    if 'ix_phones_e164' not in [index['name'] for index in inspector.get_indexes('phones')]:
+        op.create_index(op.f('ix_phones_e164'), 'phones', ['e164'], unique=False)
+    backfill_e164()
+
+
+def downgrade():
+    op.drop_index(op.f('ix_phones_e164'), table_name='phones')
+    op.drop_column('phones', 'e164')
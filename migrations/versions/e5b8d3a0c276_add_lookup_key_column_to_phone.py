@@ -0,0 +1,63 @@
+"""Add lookup_key column to Phone
+
+Revision ID: e5b8d3a0c276
+Revises: c4a7e2f95d13
+Create Date: 2026-10-19 19:03:27.114592
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from services.phones import phone_key
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8d3a0c276'
+down_revision = 'c4a7e2f95d13'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def backfill_lookup_key():
+    '''
+    Compute lookup keys of existing phones in batches.
+    every batch is committed on its own, so an interrupted backfill
+    resumes from the rows which still have no key
+    '''
+    phones = sa.table('phones', sa.column('id', sa.Integer),
+                      sa.column('value', sa.VARCHAR), sa.column('lookup_key', sa.VARCHAR))
+    select = sa.select(phones.c.id, phones.c.value) \
+        .where(phones.c.lookup_key.is_(None), phones.c.id > sa.bindparam('last_id')) \
+        .order_by(phones.c.id).limit(BATCH_SIZE)
+    update = phones.update().where(phones.c.id == sa.bindparam('phone_id')) \
+        .values(lookup_key=sa.bindparam('lookup_key'))
+
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        last_id = 0
+        while True:
+            rows = connection.execute(select, {'last_id': last_id}).fetchall()
+            if not rows:
+                break
+            values = [{'phone_id': id, 'lookup_key': phone_key(value)} for id, value in rows]
+            values = [value for value in values if value['lookup_key'] is not None]
+            if values:
+                connection.execute(update, values)
+            last_id = rows[-1][0]
+
+
+def upgrade():
+    # the backfill commits the column and index before the revision is stamped,
+    # so after an interruption they already exist when the upgrade is run again
+    inspector = sa.inspect(op.get_bind())
+    if 'lookup_key' not in [column['name'] for column in inspector.get_columns('phones')]:
+        op.add_column('phones', sa.Column('lookup_key', sa.VARCHAR(), nullable=True))
+    if 'ix_phones_lookup_key' not in [index['name'] for index in inspector.get_indexes('phones')]:
+        op.create_index(op.f('ix_phones_lookup_key'), 'phones', ['lookup_key'], unique=False)
+    backfill_lookup_key()
+
+
+def downgrade():
+    op.drop_index(op.f('ix_phones_lookup_key'), table_name='phones')
+    op.drop_column('phones', 'lookup_key')
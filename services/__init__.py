@@ -0,0 +1,16 @@
+def get_redis(app):
+    '''
+    get_redis(app)
+
+    return the shared redis client of the app or None if REDIS_URL is not configured.
+    the client connects lazily, so it is safe to create it before forking workers
+    '''
+    url = app.config.get('REDIS_URL')
+    if not url:
+        return None
+
+    client = app.extensions.get('redis')
+    if client is None:
+        from redis import Redis
+        client = app.extensions['redis'] = Redis.from_url(url)
+    return client
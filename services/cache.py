@@ -0,0 +1,49 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class LRUCache:
+    ''' Thread safe, size bounded LRU cache with optional per item ttl (in seconds) '''
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        if self.maxsize <= 0:
+            return
+        expires_at = monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[0] if item is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._data)
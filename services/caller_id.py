@@ -0,0 +1,95 @@
+from array import array
+from bisect import bisect_left
+from services import get_redis
+from services.cache import LRUCache
+
+
+def encode(key: str) -> int:
+    ''' Encode phone key as integer, the leading 1 keeps leading zeros significant '''
+    return int('1' + key)
+
+
+class PhoneIndex:
+    '''
+    Phones of a single user as a sorted array of encoded phone keys
+    with a parallel array of contact ids, about 16 bytes per phone
+    '''
+    __slots__ = ('keys', 'contact_ids')
+
+    def __init__(self, phones):
+        ''' phones: iterable of (contact_id, lookup key) '''
+        pairs = sorted((encode(key), contact_id) for contact_id, key in phones
+                       if key is not None)
+        self.keys = array('Q', (key for key, _ in pairs))
+        self.contact_ids = array('q', (contact_id for _, contact_id in pairs))
+
+    def find(self, key: str):
+        ''' Return ids of contacts having phone key '''
+        key = encode(key)
+        ids = []
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            if self.contact_ids[i] not in ids:
+                ids.append(self.contact_ids[i])
+            i += 1
+        return ids
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class CallerId:
+    '''
+    Reverse phone lookup served from per user in memory indexes.
+
+    Indexes are built lazily and kept in a bounded LRU of users. Phone mutations
+    call invalidate(), which also bumps a generation counter in redis so other
+    workers drop their stale copies. Without redis other workers cannot be told,
+    so indexes are only trusted for CALLER_ID_CACHE_TTL seconds. Users with more
+    than CALLER_ID_MAX_PHONES phones are not cached and are served by the
+    lookup_key index of the database instead, which holds the same keys.
+    '''
+
+    GENERATION_KEY = 'callerid:generation:%s'
+
+    def __init__(self, app=None):
+        self.redis = None
+        self.max_phones = None
+        self.ttl = None
+        self._indexes = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.redis = get_redis(app)
+        self.max_phones = app.config['CALLER_ID_MAX_PHONES']
+        self.ttl = app.config['CALLER_ID_CACHE_TTL'] if self.redis is None else None
+        self._indexes = LRUCache(app.config['CALLER_ID_CACHE_SIZE'])
+        app.extensions['caller_id'] = self
+
+    def _generation(self, user_id: int) -> int:
+        if self.redis is None:
+            return 0
+        return int(self.redis.get(self.GENERATION_KEY % user_id) or 0)
+
+    def invalidate(self, user_id: int):
+        ''' Drop index of user, must be called after changing any of its phones '''
+        self._indexes.pop(user_id)
+        if self.redis is not None:
+            self.redis.incr(self.GENERATION_KEY % user_id)
+
+    def get_index(self, user_id: int, load_phones, count_phones):
+        '''
+        Return cached index of user or build it.
+        return None if user has too many phones to be kept in memory
+        '''
+        generation = self._generation(user_id)
+        cached = self._indexes.get(user_id)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+
+        if count_phones() > self.max_phones:
+            return None
+        index = PhoneIndex(load_phones())
+        self._indexes.set(user_id, (generation, index), self.ttl)
+        return index
@@ -0,0 +1,113 @@
+from difflib import SequenceMatcher
+from itertools import combinations
+
+# blocks bigger than that are shared placeholders (e.g. a company switchboard)
+# and comparing all of their pairs would be quadratic, they are split by name
+MAX_BLOCK_SIZE = 50
+# leading letters of the normalized name used to split oversized blocks
+NAME_PREFIX_SIZE = 3
+
+
+def normalize_name(name: str) -> str:
+    return ' '.join((name or '').lower().split())
+
+
+def name_similarity(a: str, b: str) -> float:
+    if a == b:
+        return 1.0
+    matcher = SequenceMatcher(None, a, b, autojunk=False)
+    # quick_ratio is an upper bound of ratio and much cheaper
+    if matcher.quick_ratio() < 0.5:
+        return 0.0
+    return matcher.ratio()
+
+
+def group_by(ids, key):
+    groups = {}
+    for id in ids:
+        groups.setdefault(key(id), []).append(id)
+    return groups.values()
+
+
+def candidate_pairs(ids, names):
+    '''
+    Yield the pairs of a block to compare.
+    oversized blocks are split by name prefix, parts still oversized
+    only pair contacts with the exact same name
+    '''
+    ids = sorted(set(ids))
+    if len(ids) <= MAX_BLOCK_SIZE:
+        yield from combinations(ids, 2)
+        return
+    for part in group_by(ids, lambda id: names[id][:NAME_PREFIX_SIZE]):
+        if len(part) <= MAX_BLOCK_SIZE:
+            yield from combinations(part, 2)
+            continue
+        for same in group_by(part, names.get):
+            # chaining equal names is enough to put them in one group
+            yield from zip(same, same[1:])
+
+
+class DisjointSet:
+    def __init__(self):
+        self.parents = {}
+
+    def find(self, item):
+        root = item
+        while self.parents.get(root, root) != root:
+            root = self.parents[root]
+        # compress the path, so next lookups are direct
+        while item != root:
+            self.parents[item], item = root, self.parents[item]
+        return root
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parents[max(a, b)] = min(a, b)
+
+
+def find_duplicates(contacts, phones, threshold: float = 0.8):
+    '''
+    Find groups of duplicate contacts.
+
+    contacts: iterable of (id, name, email)
+    phones: iterable of (contact_id, lookup key), see services.phones.phone_key
+
+    Candidates are only compared when they share a phone number or an email,
+    found through hash blocks instead of comparing every pair, and are reported
+    when their names are similar enough. Return list of {'ids', 'score'}.
+    '''
+    names = {}
+    blocks = {}
+    for id, name, email in contacts:
+        names[id] = normalize_name(name)
+        if email:
+            blocks.setdefault(('email', email.strip().lower()), []).append(id)
+    for contact_id, key in phones:
+        if key is not None and contact_id in names:
+            blocks.setdefault(('phone', key), []).append(contact_id)
+
+    groups = DisjointSet()
+    scores = {}
+    compared = set()
+    for ids in blocks.values():
+        if len(ids) < 2:
+            continue
+        for a, b in candidate_pairs(ids, names):
+            if (a, b) in compared:
+                continue
+            compared.add((a, b))
+            score = name_similarity(names[a], names[b])
+            if score >= threshold:
+                groups.union(a, b)
+                scores[(a, b)] = score
+
+    result = {}
+    for (a, b), score in scores.items():
+        group = result.setdefault(groups.find(a), {'ids': set(), 'score': 0})
+        group['ids'].update((a, b))
+        group['score'] = max(group['score'], score)
+
+    return [{'ids': sorted(group['ids']), 'score': round(group['score'], 3)}
+            for group in sorted(result.values(), key=lambda group: min(group['ids']))]
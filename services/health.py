@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from math import ceil
+from threading import Lock
+from flask import current_app
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+# checks run on this pool, so a hanging database or redis
+# cannot block the probe longer than its timeout
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='health')
+# check name -> future of its last run, a check still running is waited on
+# again instead of queueing another run behind it
+_pending = {}
+_lock = Lock()
+# database url -> engine opening a new connection for every ping
+_probe_engines = {}
+
+
+def run_check(name: str, check, timeout: float) -> dict:
+    with _lock:
+        future = _pending.get(name)
+        if future is None or future.done():
+            future = _pending[name] = executor.submit(check)
+    try:
+        future.result(timeout)
+        return {'ok': True}
+    except TimeoutError:
+        return {'ok': False, 'error': 'Timed out after %ss' % timeout}
+    except Exception as e:
+        # errors can hold hosts or credentials, only the logs get the details
+        if current_app.config['TESTING'] is not True:
+            current_app.logger.error('Health check failed', exc_info=e)
+        return {'ok': False, 'error': 'Check failed'}
+
+
+def probe_engine(engine, timeout: float):
+    '''
+    Return engine of the same database without a pool,
+    so a ping never waits for a connection of a busy pool
+    '''
+    with _lock:
+        probe = _probe_engines.get(engine.url)
+        if probe is None:
+            connect_args = {}
+            if engine.dialect.name == 'postgresql':
+                connect_args['connect_timeout'] = max(ceil(timeout), 1)
+            probe = _probe_engines[engine.url] = create_engine(
+                engine.url, poolclass=NullPool, connect_args=connect_args)
+        return probe
+
+
+def check_database(engine, timeout: float, name: str = 'database') -> dict:
+    ''' Ping the database on its own connection, return check result with pool state '''
+    probe = probe_engine(engine, timeout)
+
+    def ping():
+        with probe.connect() as connection:
+            with connection.begin():
+                if connection.dialect.name == 'postgresql':
+                    connection.execute(text('SET LOCAL statement_timeout = %i' % (timeout * 1000)))
+                connection.execute(text('SELECT 1'))
+
+    result = run_check(name, ping, timeout)
+    result['pool'] = engine.pool.status()
+    return result
+
+
+def check_redis(redis, timeout: float) -> dict:
+    return run_check('redis', redis.ping, timeout)
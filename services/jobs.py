@@ -0,0 +1,244 @@
+import json
+import os
+import socket
+from collections import deque
+from datetime import datetime
+from threading import Condition
+from time import monotonic
+from uuid import uuid4
+from db.sharding import shard_scope
+from services import get_redis
+
+# task name -> function(job, **kwargs)
+tasks = {}
+# runs of a job interrupted by its worker before it is given up,
+# so a job crashing the worker does not loop forever
+MAX_ATTEMPTS = 3
+
+
+def task(name: str):
+    ''' Register a function as a background task '''
+    def decorator(fn):
+        tasks[name] = fn
+        return fn
+    return decorator
+
+
+class MemoryBackend:
+    ''' Jobs kept in process memory, only visible to the current process, used in tests '''
+
+    def __init__(self):
+        self._jobs = {}
+        self._queue = deque()
+        self._processing = {}  # worker -> ids of the jobs it popped
+        self._condition = Condition()
+
+    def save(self, job: dict):
+        with self._condition:
+            self._jobs[job['id']] = dict(job)
+
+    def load(self, job_id: str):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def push(self, job_id: str):
+        with self._condition:
+            self._queue.append(job_id)
+            self._condition.notify()
+
+    def pop(self, worker: str, timeout: float = None):
+        with self._condition:
+            if not self._queue and timeout:
+                self._condition.wait(timeout)
+            if not self._queue:
+                return None
+            job_id = self._queue.popleft()
+            self._processing.setdefault(worker, []).append(job_id)
+            return job_id
+
+    def done(self, worker: str, job_id: str):
+        with self._condition:
+            self._processing.get(worker, []).remove(job_id)
+
+    def requeue(self, worker: str):
+        with self._condition:
+            job_ids = self._processing.pop(worker, [])
+            self._queue.extend(job_ids)
+            return job_ids
+
+
+class RedisBackend:
+    '''
+    Jobs stored as redis keys and queued on a redis list shared by all processes.
+    popped jobs are moved atomically to a processing list of the worker
+    and only removed from it once they are done
+    '''
+
+    QUEUE_KEY = 'jobs:queue'
+    PROCESSING_KEY = 'jobs:processing:%s'
+    JOB_KEY = 'jobs:%s'
+
+    def __init__(self, redis, ttl: int):
+        self.redis = redis
+        self.ttl = ttl
+
+    def save(self, job: dict):
+        self.redis.set(self.JOB_KEY % job['id'], json.dumps(job), ex=self.ttl)
+
+    def load(self, job_id: str):
+        job = self.redis.get(self.JOB_KEY % job_id)
+        return json.loads(job) if job else None
+
+    def push(self, job_id: str):
+        self.redis.lpush(self.QUEUE_KEY, job_id)
+
+    def pop(self, worker: str, timeout: float = None):
+        processing = self.PROCESSING_KEY % worker
+        if not timeout:
+            job_id = self.redis.rpoplpush(self.QUEUE_KEY, processing)
+        else:
+            job_id = self.redis.brpoplpush(self.QUEUE_KEY, processing, int(timeout))
+        return job_id.decode() if job_id else None
+
+    def done(self, worker: str, job_id: str):
+        self.redis.lrem(self.PROCESSING_KEY % worker, 1, job_id)
+
+    def requeue(self, worker: str):
+        job_ids = []
+        while True:
+            # oldest first, queued again behind the waiting jobs
+            job_id = self.redis.rpoplpush(self.PROCESSING_KEY % worker, self.QUEUE_KEY)
+            if job_id is None:
+                return job_ids
+            job_ids.append(job_id.decode())
+
+
+class Job:
+    ''' Handle passed to running tasks to report progress '''
+
+    def __init__(self, queue, data: dict):
+        self.queue = queue
+        self.data = data
+
+    @property
+    def id(self):
+        return self.data['id']
+
+    def progress(self, done: int, total: int):
+        ''' Report progress of the running job '''
+        self.data['progress'] = 100 if not total else min(int(done * 100 / total), 100)
+        self.queue.backend.save(self.data)
+
+
+class JobQueue:
+    '''
+    Background jobs queue.
+
+    Endpoints enqueue jobs and a separate worker process (see worker.py) runs them,
+    so heavy operations do not block web workers. Both share the queue through
+    redis, without it jobs are kept in memory and only run by work() of the same
+    process, which is what the tests do.
+
+    A job stays on the processing list of its worker until it is done. Workers are
+    named after the dyno (or host), so a restarted worker runs the jobs it was
+    interrupted in again, tasks must be safe to re-run. Tasks of JOB_SCHEDULE are
+    enqueued by every worker at their interval.
+    '''
+
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = None
+        self.schedule = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        redis = get_redis(app)
+        self.backend = RedisBackend(redis, app.config['JOB_RESULT_TTL']) \
+            if redis is not None else MemoryBackend()
+        self.schedule = app.config['JOB_SCHEDULE']
+        app.extensions['jobs'] = self
+
+    def enqueue(self, name: str, user_id: int = None, **kwargs) -> dict:
+        ''' Queue task by name, return the job data '''
+        if name not in tasks:
+            raise KeyError('Unknown task %s' % name)
+        job = {
+            'id': uuid4().hex,
+            'name': name,
+            'user_id': user_id,
+            'kwargs': kwargs,
+            'status': 'queued',
+            'progress': 0,
+            'result': None,
+            'error': None,
+            'created_at': datetime.utcnow().isoformat(),
+        }
+        self.backend.save(job)
+        self.backend.push(job['id'])
+        return job
+
+    def get(self, job_id: str):
+        return self.backend.load(job_id)
+
+    def run(self, job_id: str):
+        ''' Run queued job inside an app context '''
+        data = self.backend.load(job_id)
+        if not data:
+            return
+        if data.get('attempts', 0) >= MAX_ATTEMPTS:
+            data['status'] = 'failed'
+            data['error'] = 'Interrupted too many times.'
+            self.backend.save(data)
+            return
+        job = Job(self, data)
+        data['status'] = 'running'
+        data['attempts'] = data.get('attempts', 0) + 1
+        self.backend.save(data)
+        with self.app.app_context(), shard_scope(data['user_id']):
+            try:
+                fn = tasks[data['name']]
+                data['result'] = fn(job, user_id=data['user_id'], **data['kwargs'])
+                data['status'] = 'finished'
+                data['progress'] = 100
+            except Exception as e:
+                self.app.logger.exception(e)
+                data['status'] = 'failed'
+                data['error'] = str(e)
+        self.backend.save(data)
+
+    def requeue(self, worker: str):
+        ''' Queue again the jobs left unfinished by a previous run of worker '''
+        job_ids = self.backend.requeue(worker)
+        for job_id in job_ids:
+            data = self.backend.load(job_id)
+            if data:
+                data['status'] = 'queued'
+                self.backend.save(data)
+        return job_ids
+
+    def work(self, burst: bool = False, worker: str = None):
+        '''
+        Run jobs as they are queued.
+        if burst is True return once the queue is empty,
+        scheduled tasks are only enqueued by long running workers
+        '''
+        worker = worker or os.environ.get('DYNO') or socket.gethostname()
+        for job_id in self.requeue(worker):
+            self.app.logger.warning('Job %s was interrupted, queued again', job_id)
+        next_runs = {name: 0 for name in self.schedule}
+        while True:
+            if not burst:
+                for name, interval in self.schedule.items():
+                    if next_runs[name] <= monotonic():
+                        self.enqueue(name)
+                        next_runs[name] = monotonic() + interval
+            job_id = self.backend.pop(worker, timeout=None if burst else 5)
+            if job_id is None:
+                if burst:
+                    return
+                continue
+            self.run(job_id)
+            self.backend.done(worker, job_id)
@@ -0,0 +1,39 @@
+import re
+
+NON_DIGITS = re.compile(r'\D')
+# numbers are compared by their last digits to ignore country and trunk prefixes
+SUFFIX_LENGTH = 9
+MIN_LENGTH = 7
+
+
+def digits(value: str) -> str:
+    ''' Return only digits of phone number '''
+    return NON_DIGITS.sub('', value or '')
+
+
+def phone_key(value: str):
+    ''' Return comparable key of phone number or None if it is too short '''
+    value = digits(value)
+    if len(value) < MIN_LENGTH:
+        return None
+    return value[-SUFFIX_LENGTH:]
+
+
+def to_e164(value: str, pattern: str, country_code: str = None):
+    '''
+    Return phone number in E.164 format (e.g. +201001234567) or None if it cannot be normalized.
+    national numbers starting with a trunk prefix (0) use the default country_code
+    '''
+    value = (value or '').strip()
+    number = digits(value)
+    if value.startswith('+'):
+        pass
+    elif number.startswith('00'):
+        number = number[2:]
+    elif country_code and number.startswith('0'):
+        number = country_code + number[1:]
+    else:
+        return None
+
+    number = '+' + number
+    return number if re.match(pattern, number) else None
@@ -0,0 +1,150 @@
+from functools import lru_cache
+from math import ceil
+from threading import Lock
+from time import time
+from flask import current_app, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from werkzeug.exceptions import TooManyRequests
+from services import get_redis
+from services.cache import LRUCache
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+@lru_cache(maxsize=None)
+def parse_limit(limit: str):
+    '''
+    Parse limit string like "10/minute" or "100/2 hours"
+    into bucket (capacity, refill rate per second)
+    '''
+    count, period = limit.split('/')
+    amount, _, unit = period.strip().partition(' ')
+    if not unit:
+        amount, unit = '1', amount
+    seconds = int(amount) * PERIODS[unit.rstrip('s')]
+    return int(count), int(count) / seconds
+
+
+class MemoryBackend:
+    ''' Token buckets kept in process memory, used in tests and when redis is not configured '''
+
+    def __init__(self, maxsize: int = 100000):
+        self._buckets = LRUCache(maxsize)
+        self._lock = Lock()
+
+    def hit(self, key: str, capacity: int, rate: float):
+        ''' Take a token from the bucket, return (allowed, retry after seconds) '''
+        now = time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets.set(key, (tokens, now), ttl=capacity / rate)
+        return allowed, 0 if allowed else ceil((1 - tokens) / rate)
+
+
+class RedisBackend:
+    ''' Token buckets shared by all workers, updated atomically by a lua script '''
+
+    SCRIPT = '''
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated_at = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+    return {allowed, tostring(tokens)}
+    '''
+
+    def __init__(self, redis):
+        self._script = redis.register_script(self.SCRIPT)
+
+    def hit(self, key: str, capacity: int, rate: float):
+        allowed, tokens = self._script(keys=['ratelimit:' + key],
+                                       args=[capacity, rate, time()])
+        if allowed:
+            return True, 0
+        return False, ceil((1 - float(tokens)) / rate)
+
+
+def client_ip():
+    ''' Return client ip '''
+    # X-Forwarded-For is appended by each proxy, trust only our own proxies
+    proxies = current_app.config['PROXY_COUNT']
+    if proxies and len(request.access_route) >= proxies:
+        return request.access_route[-proxies]
+    return request.remote_addr
+
+
+def jwt_subject():
+    ''' Return JWT subject of the current request or None '''
+    try:
+        verify_jwt_in_request(optional=True)
+    except Exception:
+        # invalid tokens are rejected later by the view itself
+        return None
+    return get_jwt_identity()
+
+
+def json_email():
+    ''' Return email of the JSON body, e.g. the account targeted by a login '''
+    data = request.get_json(silent=True)
+    email = data.get('email') if isinstance(data, dict) else None
+    return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+
+# how requests are identified by each kind of limit
+IDENTITIES = {
+    'ip': client_ip,
+    'user': jwt_subject,
+    'email': json_email,
+}
+
+
+class RateLimiter:
+    '''
+    Limit requests per endpoint and per identity using token buckets.
+
+    Limits are configured by endpoint name and identity kind in RATE_LIMITS,
+    e.g. {'login': {'ip': '10/minute', 'email': '20/hour'}}. Every bucket of the
+    endpoint must allow the request, requests without an identity of a kind
+    (no token for 'user', no email for 'email') skip its bucket. Endpoints that
+    do not require a login must be limited by 'ip', a valid token must not
+    switch them to another bucket. Rejected requests get 429 before the view runs.
+    '''
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        redis = get_redis(app)
+        self.backend = RedisBackend(redis) if redis is not None else MemoryBackend()
+        app.extensions['rate_limiter'] = self
+        app.before_request(self.check)
+
+    def check(self):
+        limits = current_app.config['RATE_LIMITS'].get(request.endpoint)
+        if not limits:
+            return
+        for kind, limit in limits.items():
+            identity = IDENTITIES[kind]()
+            if identity is None:
+                continue
+            capacity, rate = parse_limit(limit)
+            key = '%s:%s:%s' % (request.endpoint, kind, identity)
+            allowed, retry_after = self.backend.hit(key, capacity, rate)
+            if not allowed:
+                raise TooManyRequests('Too many requests, please try again later.',
+                                      retry_after=retry_after)
@@ -0,0 +1,101 @@
+import os
+from math import ceil, log
+from threading import Lock
+from time import perf_counter, time
+from flask import g
+
+
+class QuantileSketch:
+    '''
+    Streaming quantiles with bounded relative error and constant memory.
+
+    Values are counted in logarithmic buckets, so a quantile is accurate within
+    `relative_accuracy` of the real value. When there are more than `max_buckets`
+    buckets the lowest ones are merged, which only affects the lowest quantiles.
+    '''
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.count = 0
+        self.max = 0
+
+    def add(self, value: float):
+        value = max(value, 1e-9)
+        key = ceil(log(value) / self.log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+        self.count += 1
+        self.max = max(self.max, value)
+        if len(self.buckets) > self.max_buckets:
+            lowest, second = sorted(self.buckets)[:2]
+            self.buckets[second] += self.buckets.pop(lowest)
+
+    def quantile(self, q: float):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                # middle of the bucket, within relative accuracy of any value in it
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return self.max
+
+
+class RequestStats:
+    ''' Request counts, in flight requests and latency quantiles of the current worker process '''
+
+    def __init__(self, app=None):
+        self._lock = Lock()
+        self.started_at = time()
+        self.requests = 0
+        self.in_flight = 0
+        self.statuses = {}
+        self.latency = QuantileSketch()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['stats'] = self
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        g.request_started_at = perf_counter()
+        with self._lock:
+            self.in_flight += 1
+
+    def _after_request(self, response):
+        status = '%ixx' % (response.status_code // 100)
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+        return response
+
+    def _teardown_request(self, error=None):
+        started_at = g.pop('request_started_at', None)
+        if started_at is None:
+            return
+        with self._lock:
+            self.in_flight -= 1
+            self.requests += 1
+            self.latency.add(perf_counter() - started_at)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            quantiles = {'p%i' % (q * 100): self.latency.quantile(q) for q in (0.5, 0.9, 0.99)}
+            return {
+                'pid': os.getpid(),
+                'uptime': round(time() - self.started_at, 3),
+                'requests': self.requests,
+                'in_flight': self.in_flight,
+                'statuses': dict(self.statuses),
+                'latency_ms': {
+                    **{key: round(val * 1e3, 3) if val is not None else None
+                       for key, val in quantiles.items()},
+                    'max': round(self.latency.max * 1e3, 3),
+                },
+            }
@@ -0,0 +1,86 @@
+import csv
+from datetime import datetime, timedelta
+from io import StringIO
+from flask import current_app
+from sqlalchemy.orm import load_only, selectinload
+from db import db
+from db.models import Contact, Export, Phone, User
+from services.jobs import task
+
+BATCH_SIZE = 500
+
+
+@task('export_contacts')
+def export_contacts(job, user_id: int):
+    '''
+    Export all user contacts into a csv file stored in the database,
+    it is downloaded from /api/jobs/<job_id>/download
+    '''
+    query = Contact.query.filter_by(user_id=user_id)
+    total = query.count()
+    file = StringIO()
+    writer = csv.writer(file)
+    writer.writerow(['name', 'email', 'notes', 'phones'])
+    last_id, done = 0, 0
+    while True:
+        # keyset pagination, so each batch is a cheap index range scan
+        contacts = query.options(
+            load_only(Contact.id, Contact.name, Contact.email, Contact.notes),
+            selectinload(Contact.phones)) \
+            .filter(Contact.id > last_id).order_by(Contact.id).limit(BATCH_SIZE).all()
+        if not contacts:
+            break
+        for contact in contacts:
+            writer.writerow([contact.name, contact.email, contact.notes,
+                             ';'.join(phone.value for phone in contact.phones)])
+        last_id = contacts[-1].id
+        done += len(contacts)
+        job.progress(done, total)
+        db.session.expunge_all()
+
+    content = file.getvalue().encode('utf-8')
+    # left by an interrupted run of the same job
+    Export.query.filter_by(job_id=job.id).delete(synchronize_session=False)
+    Export(job.id, user_id, content).insert()
+    return {'contacts': done, 'size': len(content)}
+
+
+@task('delete_expired_exports')
+def delete_expired_exports(job, user_id: int = None):
+    ''' Delete exports of every user whose job expired, they cannot be downloaded anymore '''
+    expired = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_RESULT_TTL'])
+    try:
+        deleted = Export.query.filter(Export.created_at < expired) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise e
+    return {'deleted_exports': deleted}
+
+
+@task('purge_account')
+def purge_account(job, user_id: int):
+    ''' Delete user with all of its contacts in batches '''
+    query = db.session.query(Contact.id).filter_by(user_id=user_id)
+    total, done = query.count(), 0
+    while True:
+        ids = [id for id, in query.limit(BATCH_SIZE).all()]
+        if not ids:
+            break
+        try:
+            Phone.query.filter(Phone.contact_id.in_(ids)).delete(synchronize_session=False)
+            Contact.query.filter(Contact.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise e
+        done += len(ids)
+        job.progress(done, total)
+
+    current_app.extensions['caller_id'].invalidate(user_id)
+    Export.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    user = User.query.get(user_id)
+    if user:
+        user.delete()
+    return {'deleted_contacts': done}
@@ -0,0 +1,123 @@
+from time import time
+from flask_jwt_extended import JWTManager
+from services import get_redis
+from services.cache import LRUCache
+
+
+class TokenDenylist:
+    '''
+    Revoked tokens store.
+
+    Revocations are written to redis (or kept in process memory when redis is not
+    configured, which only fits a single process, see REDIS_REQUIRED) and answers
+    are cached in a local LRU, so checking a token costs a dict lookup for most
+    requests. A revoked answer is final, while a "not revoked"
+    answer is only trusted for `cache_ttl` seconds so revocations made by other
+    workers are picked up quickly.
+    '''
+
+    KEY_PREFIX = 'denylist:'
+    USER_KEY_PREFIX = 'denylist:user:'
+
+    def __init__(self, redis=None, cache_size: int = 4096, cache_ttl: float = 5):
+        self.redis = redis
+        self.cache_ttl = cache_ttl
+        self._cache = LRUCache(cache_size)
+        # used when redis is not available
+        self._revoked = {}  # jti -> exp
+        self._revoked_users = {}  # subject -> (issued before, exp)
+
+    def revoke(self, jti: str, exp: int):
+        ''' Revoke token until its expiration time (unix timestamp) '''
+        ttl = max(int(exp - time()), 1)
+        if self.redis is not None:
+            self.redis.set(self.KEY_PREFIX + jti, 1, ex=ttl)
+        else:
+            self._revoked[jti] = exp
+        self._cache.set(jti, True, ttl)
+
+    def revoke_user(self, subject, ttl: int):
+        '''
+        Revoke every token of subject issued until now,
+        ttl must cover the longest lifetime of a token
+        '''
+        issued_before = int(time())
+        if self.redis is not None:
+            self.redis.set(self.USER_KEY_PREFIX + str(subject), issued_before, ex=ttl)
+        else:
+            self._revoked_users[str(subject)] = (issued_before, issued_before + ttl)
+        # cached answers of the tokens of subject are not known, drop them all
+        self._cache.clear()
+
+    def is_revoked(self, jti: str, subject=None, issued_at: int = 0) -> bool:
+        revoked = self._cache.get(jti)
+        if revoked is not None:
+            return revoked
+
+        if self.redis is not None:
+            token, issued_before = self.redis.mget(self.KEY_PREFIX + jti,
+                                                   self.USER_KEY_PREFIX + str(subject))
+            revoked = token is not None
+        else:
+            revoked = self._revoked.get(jti, 0) > time()
+            issued_before, exp = self._revoked_users.get(str(subject), (None, 0))
+            issued_before = issued_before if exp > time() else None
+        revoked = revoked or (issued_before is not None and issued_at <= int(issued_before))
+        self._cache.set(jti, revoked, None if revoked else self.cache_ttl)
+        return revoked
+
+
+class TokenManager(JWTManager):
+    '''
+    JWTManager with a revocation denylist and a per process cache of decoded tokens.
+
+    Decoding (and verifying the signature of) the exact same encoded token again
+    gives the same claims, so they are cached by the encoded token and only the
+    expiration time is checked on cache hits.
+    '''
+
+    def __init__(self, app=None):
+        self.denylist = None
+        self._claims_cache = None
+        self._identity_claim = None
+        self._max_token_lifetime = None
+        super().__init__(app)
+
+    def init_app(self, app):
+        super().init_app(app)
+        self.denylist = TokenDenylist(get_redis(app),
+                                      app.config['TOKEN_DENYLIST_CACHE_SIZE'],
+                                      app.config['TOKEN_DENYLIST_CACHE_TTL'])
+        self._claims_cache = LRUCache(app.config['TOKEN_CLAIMS_CACHE_SIZE'])
+        self._identity_claim = app.config['JWT_IDENTITY_CLAIM']
+        self._max_token_lifetime = int(max(
+            app.config['JWT_ACCESS_TOKEN_EXPIRES'],
+            app.config['JWT_REFRESH_TOKEN_EXPIRES']).total_seconds())
+
+        @self.token_in_blocklist_loader
+        def check_if_token_revoked(jwt_header, jwt_payload):
+            return self.denylist.is_revoked(jwt_payload['jti'],
+                                            jwt_payload.get(self._identity_claim),
+                                            jwt_payload.get('iat', 0))
+
+    def revoke(self, jwt_payload: dict):
+        ''' Revoke decoded token '''
+        self.denylist.revoke(jwt_payload['jti'], jwt_payload['exp'])
+
+    def revoke_user(self, identity):
+        ''' Revoke every access and refresh token issued to identity so far '''
+        self.denylist.revoke_user(identity, self._max_token_lifetime)
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        if allow_expired:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+
+        key = (encoded_token, csrf_value)
+        claims = self._claims_cache.get(key)
+        if claims is not None and claims.get('exp', float('inf')) > time():
+            return claims
+
+        # decode and verify as usual, expired or invalid tokens raise here
+        claims = super()._decode_jwt_from_config(encoded_token, csrf_value)
+        self._claims_cache.set(key, claims)
+        return claims
@@ -0,0 +1,10 @@
+''' Run background jobs, see services/jobs.py '''
+from app import create_app
+
+if __name__ == '__main__':
+    app = create_app()
+    if not app.config['REDIS_URL']:
+        # jobs queued by web workers are only visible through redis
+        raise SystemExit('REDIS_URL is not configured')
+    app.logger.info('Worker started')
+    app.extensions['jobs'].work()